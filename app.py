@@ -1,17 +1,50 @@
-from flask import Flask, render_template, request, jsonify
-from werkzeug.utils import secure_filename
+from flask import Flask, Request, render_template, request, jsonify
 import os
-import json
-import base64
-from openai import OpenAI
-from PIL import Image
+import re
+import string
+import struct
+import orjson
+import pybase64
+import pickle
+import sqlite3
+import time
+import hashlib
+from contextlib import closing
+from io import BytesIO
+from bisect import bisect_right
+from collections import Counter
+import ahocorasick
+
+# Heavy dependencies used only by /api/analyze; imported on first use so cold starts
+# and the index page don't pay for them (see _load_image_libs and _get_openai_client)
+Image = ImageOps = cv2 = np = None
+
+class InMemoryRequest(Request):
+    """Request that keeps uploaded files in memory instead of spooling them to temp files."""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Upload size is already capped by MAX_CONTENT_LENGTH
+        return BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 # Use /tmp on Vercel (writable) or 'uploads' locally
 app.config['UPLOAD_FOLDER'] = '/tmp' if os.path.exists('/tmp') else 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
 
+# Images are downscaled to fit this box before being sent to OpenAI
+MAX_IMAGE_SIZE = (1024, 1024)
+# Plate detection runs on a grayscale copy scaled down to fit this box
+PLATE_DETECT_SIZE = (256, 256)
+# Uploads in these formats that are under this size and already fit MAX_IMAGE_SIZE
+# are sent as-is, without decoding
+PASSTHROUGH_MAX_BYTES = 256 * 1024
+PASSTHROUGH_MIME_TYPES = {'image/jpeg', 'image/png'}
+
+# JSON array inside the model's reply (it sometimes wraps it in extra text)
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+
 # Create uploads directory if it doesn't exist (only if not using /tmp)
 if app.config['UPLOAD_FOLDER'] != '/tmp':
     try:
@@ -34,163 +67,475 @@ def load_calorie_db():
         print(f"Error loading CALORIE_DB: {e}")
         return {}
 
-CALORIE_DB = load_calorie_db()
+def _load_or_build_cache(db_path='CALORIE_DB', cache_path='CALORIE_DB.cache.pkl'):
+    """
+    Load CALORIE_DB from a pickle cache, rebuilding it when the source is newer.
+    Falls back to load_calorie_db() if the cache can't be read or written.
+    """
+    try:
+        if os.stat(cache_path).st_mtime >= os.stat(db_path).st_mtime:
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+    
+    calorie_db = load_calorie_db()
+    if calorie_db:
+        try:
+            with open(cache_path, 'wb') as f:
+                pickle.dump(calorie_db, f, protocol=5)
+        except OSError as e:
+            # Read-only filesystem (e.g. Vercel) - just skip caching
+            print(f"Could not write CALORIE_DB cache: {e}")
+    return calorie_db
+
+CALORIE_DB = _load_or_build_cache()
+
+# CALORIE_DB as JSON for the index page, serialized once instead of per request
+CALORIE_DB_JSON = orjson.dumps(CALORIE_DB).decode('utf-8')
+
+# Punctuation (including '_' in keys) separates words when matching food names.
+# Apostrophes are kept since they are part of Ukrainian words (м'ясо, трав'яний).
+_NORM = str.maketrans({c: ' ' for c in string.punctuation if c != "'"})
+
+def _norm_words(text):
+    """Lowercase text, turn punctuation into spaces and split into words."""
+    return text.lower().translate(_NORM).split()
+
+def _norm(text):
+    """Normalized form of text used for matching, e.g. 'Chicken_breast, grilled' -> 'chicken breast grilled'."""
+    return ' '.join(_norm_words(text))
+
+# Normalized lookup index for match_food_to_db, built once at import.
+# Parallel tuples indexed the same way as CALORIE_DB keys; None marks a missing name.
+_MATCH_LANGS = ('en', 'ru', 'uk')
+_KEYS = tuple(CALORIE_DB)
+_KEYS_NORM = tuple(_norm(key) for key in _KEYS)
+_NAMES_NORM = tuple(
+    tuple(_norm(item[f'name_{lang}']) if f'name_{lang}' in item else None for lang in _MATCH_LANGS)
+    for item in CALORIE_DB.values()
+)
+
+def _build_alias_to_key():
+    """Map each normalized key/name to its key; keys win over names, earlier entries over later."""
+    alias_to_key = {}
+    for idx, key_norm in enumerate(_KEYS_NORM):
+        alias_to_key.setdefault(key_norm, _KEYS[idx])
+    for idx, names in enumerate(_NAMES_NORM):
+        for item_name in names:
+            if item_name:
+                alias_to_key.setdefault(item_name, _KEYS[idx])
+    return alias_to_key
+
+_ALIAS_TO_KEY = _build_alias_to_key()
+
+def _build_haystack(texts):
+    """Join texts into one searchable string; returns (haystack, start offset of each text)."""
+    offsets = []
+    pos = 0
+    for text in texts:
+        offsets.append(pos)
+        pos += len(text) + 1
+    return '\x00'.join(texts), offsets
+
+def _fields_containing(haystack, offsets, needle):
+    """Yield indices (ascending) of the texts in a haystack that contain needle."""
+    pos = haystack.find(needle)
+    while pos >= 0:
+        field = bisect_right(offsets, pos) - 1
+        yield field
+        if field + 1 >= len(offsets):
+            break
+        pos = haystack.find(needle, offsets[field + 1])
+
+# "description in alias" is answered with str.find over these haystacks,
+# "alias in description" with a single Aho-Corasick scan of the description.
+_KEYS_HAYSTACK = _build_haystack(_KEYS_NORM)
+_NAMES_HAYSTACK = _build_haystack([name or '' for names in _NAMES_NORM for name in names])
+
+def _build_alias_automaton():
+    """
+    Build an Aho-Corasick automaton over all aliases.
+    Each alias maps to (first key index, first name index), None where it doesn't occur.
+    """
+    aliases = {}
+    for idx, key_norm in enumerate(_KEYS_NORM):
+        hits = aliases.setdefault(key_norm, [None, None])
+        if hits[0] is None:
+            hits[0] = idx
+        for item_name in _NAMES_NORM[idx]:
+            if item_name:
+                hits = aliases.setdefault(item_name, [None, None])
+                if hits[1] is None:
+                    hits[1] = idx
+    
+    automaton = ahocorasick.Automaton()
+    for alias, (key_idx, name_idx) in aliases.items():
+        automaton.add_word(alias, (key_idx, name_idx))
+    automaton.make_automaton()
+    return automaton
+
+_ALIAS_AUTOMATON = _build_alias_automaton()
+
+def _word_postings(word):
+    """Key indices of every key/name containing word; an index repeats once per matching key/name."""
+    postings = list(_fields_containing(*_KEYS_HAYSTACK, word))
+    postings.extend(field // len(_MATCH_LANGS) for field in _fields_containing(*_NAMES_HAYSTACK, word))
+    return tuple(postings)
+
+def _build_inverted_index():
+    """Precompute postings for every word that appears in CALORIE_DB keys and names."""
+    tokens = set()
+    for idx, key_norm in enumerate(_KEYS_NORM):
+        tokens.update(key_norm.split())
+        for item_name in _NAMES_NORM[idx]:
+            if item_name:
+                tokens.update(item_name.split())
+    return {token: _word_postings(token) for token in tokens}
+
+_INVERTED = _build_inverted_index()
 
 # Initialize OpenAI client
+# The request worker waits on the Vision call, so bound it instead of relying on
+# the SDK defaults (10 minute timeout, 2 retries)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if OPENAI_API_KEY:
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
-else:
-    openai_client = None
+OPENAI_TIMEOUT = 30.0  # seconds
+OPENAI_MAX_RETRIES = 1
+OPENAI_MODEL = "gpt-4o"  # or "gpt-4-vision-preview"
+_openai_client = None
+if not OPENAI_API_KEY:
     print("Warning: OPENAI_API_KEY not set. Food recognition will not work.")
 
+def _get_openai_client():
+    """Create OpenAI client on first use. Returns None if OPENAI_API_KEY is not set."""
+    global _openai_client
+    if _openai_client is None and OPENAI_API_KEY:
+        from openai import OpenAI
+        _openai_client = OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT, max_retries=OPENAI_MAX_RETRIES)
+    return _openai_client
+
+# Prompt for the Vision call; it doesn't depend on the image
+_PROMPT = """Analyze this food photo and identify all food items visible on the plate.
+
+Return a JSON array with objects containing:
+- "food": the name/description of the food item (in English, be specific)
+- "estimated_grams": estimated portion size in grams
+
+Focus on identifying the main food items. Be specific about the type of food (e.g., "chicken breast" not just "chicken", "cooked rice" not just "rice").
+
+Example format:
+[
+  {"food": "chicken breast", "estimated_grams": 150},
+  {"food": "cooked rice", "estimated_grams": 200},
+  {"food": "steamed broccoli", "estimated_grams": 100}
+]
+
+Return ONLY valid JSON, no additional text."""
+
+# Vision replies are cached by image hash so re-uploading the same photo skips the API call.
+# Bump PROMPT_VERSION whenever _PROMPT or the image preprocessing changes (MAX_IMAGE_SIZE,
+# passthrough limits, plate crop, "detail" level) so stale replies aren't reused.
+PROMPT_VERSION = 1
+# Kept in the app's own uploads/ dir so checkouts don't share it; on Vercel only /tmp is writable
+VISION_CACHE_DIR = '/tmp' if os.getenv('VERCEL') else 'uploads'
+try:
+    os.makedirs(VISION_CACHE_DIR, exist_ok=True)
+except OSError:
+    VISION_CACHE_DIR = app.config['UPLOAD_FOLDER']
+VISION_CACHE_PATH = os.path.join(VISION_CACHE_DIR, 'vision_cache.sqlite3')
+# /tmp is size-limited on Vercel, so old entries are pruned on every insert
+VISION_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # seconds
+VISION_CACHE_MAX_ROWS = 1000
+
+def _init_vision_cache():
+    """Create the vision cache table if it doesn't exist."""
+    try:
+        with closing(sqlite3.connect(VISION_CACHE_PATH)) as conn, conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(vision_cache)")}
+            if columns and 'created_at' not in columns:
+                # Table from before entries were timestamped; it's only a cache, so start over
+                conn.execute("DROP TABLE vision_cache")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS vision_cache ("
+                "image_hash TEXT, model TEXT, prompt_version INTEGER, response TEXT, created_at REAL, "
+                "PRIMARY KEY (image_hash, model, prompt_version))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS vision_cache_created_at ON vision_cache (created_at)")
+    except sqlite3.Error as e:
+        print(f"Error initializing vision cache: {e}")
+
+def _vision_cache_get(image_hash):
+    """Return cached OpenAI reply for the image hash, or None."""
+    try:
+        with closing(sqlite3.connect(VISION_CACHE_PATH)) as conn:
+            row = conn.execute(
+                "SELECT response FROM vision_cache "
+                "WHERE image_hash = ? AND model = ? AND prompt_version = ? AND created_at >= ?",
+                (image_hash, OPENAI_MODEL, PROMPT_VERSION, time.time() - VISION_CACHE_MAX_AGE)
+            ).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        print(f"Error reading vision cache: {e}")
+        return None
+
+def _vision_cache_put(image_hash, response_text):
+    """Store OpenAI reply for the image hash, pruning expired and excess entries."""
+    now = time.time()
+    try:
+        with closing(sqlite3.connect(VISION_CACHE_PATH)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO vision_cache (image_hash, model, prompt_version, response, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (image_hash, OPENAI_MODEL, PROMPT_VERSION, response_text, now)
+            )
+            conn.execute("DELETE FROM vision_cache WHERE created_at < ?", (now - VISION_CACHE_MAX_AGE,))
+            conn.execute(
+                "DELETE FROM vision_cache WHERE rowid NOT IN "
+                "(SELECT rowid FROM vision_cache ORDER BY created_at DESC LIMIT ?)",
+                (VISION_CACHE_MAX_ROWS,)
+            )
+    except sqlite3.Error as e:
+        print(f"Error writing vision cache: {e}")
+
+_init_vision_cache()
+
 def allowed_file(filename):
     """Check if file extension is allowed."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-def encode_image_to_base64(image_path):
-    """Encode image to base64 string for OpenAI API."""
+def _load_image_libs():
+    """Import Pillow, OpenCV and NumPy on first use."""
+    global Image, ImageOps, cv2, np
+    if Image is None:
+        import cv2
+        import numpy as np
+        from PIL import Image, ImageOps
+
+def _sniff_mime(image_bytes):
+    """Detect image MIME type from the file's magic bytes. Returns None if unknown."""
+    if image_bytes.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if image_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if image_bytes.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def _crop_to_plate(image):
+    """
+    Crop image to the union of all plate-sized circles found by a Hough transform
+    (so side dishes next to the plate are kept), expanded by 10%.
+    Returns the image unchanged if no plate-sized circle is found.
+    """
+    try:
+        small = image.convert('L')
+        small.thumbnail(PLATE_DETECT_SIZE, Image.BILINEAR)
+        gray = cv2.medianBlur(np.asarray(small), 5)
+        min_side = min(gray.shape)
+        min_radius = int(min_side * 0.2)
+        circles = cv2.HoughCircles(
+            gray, cv2.HOUGH_GRADIENT, dp=1.5, minDist=min_radius,
+            param1=100, param2=40,
+            minRadius=min_radius, maxRadius=int(max(gray.shape) * 0.6)
+        )
+    except cv2.error as e:
+        print(f"Error detecting plate: {e}")
+        return image
+    if circles is None:
+        return image
+    
+    scale = image.width / small.width
+    left, top = image.width, image.height
+    right = bottom = 0
+    for x, y, r in circles[0] * scale:
+        r *= 1.1
+        left, top = min(left, x - r), min(top, y - r)
+        right, bottom = max(right, x + r), max(bottom, y + r)
+    return image.crop((
+        max(0, int(left)), max(0, int(top)),
+        min(image.width, int(right)), min(image.height, int(bottom))
+    ))
+
+def _sniff_dimensions(image_bytes, mime_type):
+    """Read (width, height) from a JPEG/PNG header without decoding. Returns None if not found."""
+    if mime_type == 'image/png':
+        # IHDR is always the first chunk: width and height follow the 8-byte signature + chunk header
+        return struct.unpack('>II', image_bytes[16:24]) if len(image_bytes) >= 24 else None
+    if mime_type != 'image/jpeg':
+        return None
+    
+    # Walk JPEG segments until the start-of-frame marker that carries the size
+    pos = 2
+    while pos + 9 <= len(image_bytes):
+        if image_bytes[pos] != 0xFF:
+            return None
+        marker = image_bytes[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            pos += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', image_bytes[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + struct.unpack('>H', image_bytes[pos + 2:pos + 4])[0]
+    return None
+
+def encode_image_to_base64(image_bytes):
+    """
+    Encode image to base64 bytes for OpenAI API. Returns (mime_type, base64_image).
+    JPEG/PNG uploads that are small both in bytes and in pixels (fit MAX_IMAGE_SIZE, read from
+    the header) are sent as-is, so they skip EXIF rotation and the plate crop. Anything else
+    is rotated, downscaled, cropped to the plate and recompressed to JPEG, since the model
+    gets the photo in low detail anyway.
+    """
+    mime_type = _sniff_mime(image_bytes)
+    if mime_type in PASSTHROUGH_MIME_TYPES and len(image_bytes) <= PASSTHROUGH_MAX_BYTES:
+        size = _sniff_dimensions(image_bytes, mime_type)
+        if size and size[0] <= MAX_IMAGE_SIZE[0] and size[1] <= MAX_IMAGE_SIZE[1]:
+            return mime_type, pybase64.b64encode(image_bytes)
+    
     try:
-        with open(image_path, 'rb') as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        _load_image_libs()
+        with Image.open(BytesIO(image_bytes)) as image:
+            image.thumbnail(MAX_IMAGE_SIZE, Image.BILINEAR)
+            image = _crop_to_plate(ImageOps.exif_transpose(image)).convert('RGB')
+            buffer = BytesIO()
+            image.save(buffer, format='JPEG', quality=85, optimize=True)
+        return 'image/jpeg', pybase64.b64encode(buffer.getvalue())
     except Exception as e:
         print(f"Error encoding image: {e}")
-        return None
+        return None, None
 
-def match_food_to_db(food_description, calorie_db):
+def match_food_to_db(food_description):
     """
     Match food description from OpenAI to keys in CALORIE_DB.
     Returns the best matching key or None.
     """
-    food_lower = food_description.lower()
+    if not _KEYS:
+        return None
+    # Normalize once; the words are reused for partial matching below
+    food_words = _norm_words(food_description)
+    if not food_words:
+        return None
+    food_norm = ' '.join(food_words)
+    
+    # Common case: description is exactly a key or a name (single hash lookup)
+    exact_key = _ALIAS_TO_KEY.get(food_norm)
+    if exact_key is not None:
+        return exact_key
+    
+    # Keys and names contained in the description (single automaton pass)
+    key_hit = name_hit = None
+    for _, (key_idx, name_idx) in _ALIAS_AUTOMATON.iter(food_norm):
+        if key_idx is not None and (key_hit is None or key_idx < key_hit):
+            key_hit = key_idx
+        if name_idx is not None and (name_hit is None or name_idx < name_hit):
+            name_hit = name_idx
     
     # Try exact match first
-    for key in calorie_db.keys():
-        if food_lower in key.lower() or key.lower() in food_lower:
-            return key
+    idx = next(_fields_containing(*_KEYS_HAYSTACK, food_norm), None)
+    if idx is not None and (key_hit is None or idx < key_hit):
+        key_hit = idx
+    if key_hit is not None:
+        return _KEYS[key_hit]
     
     # Try matching by name in different languages
-    for key, item in calorie_db.items():
-        for lang in ['en', 'ru', 'uk']:
-            name_key = f'name_{lang}'
-            if name_key in item:
-                item_name = item[name_key].lower()
-                if food_lower in item_name or item_name in food_lower:
-                    return key
+    field = next(_fields_containing(*_NAMES_HAYSTACK, food_norm), None)
+    if field is not None and (name_hit is None or field // len(_MATCH_LANGS) < name_hit):
+        name_hit = field // len(_MATCH_LANGS)
+    if name_hit is not None:
+        return _KEYS[name_hit]
     
-    # Try partial matching
-    food_words = food_lower.split()
-    best_match = None
-    best_score = 0
-    
-    for key, item in calorie_db.items():
-        score = 0
-        key_lower = key.lower()
-        
-        # Check if any word from description matches
-        for word in food_words:
-            if word in key_lower:
-                score += 1
-            # Check in names
-            for lang in ['en', 'ru', 'uk']:
-                name_key = f'name_{lang}'
-                if name_key in item and word in item[name_key].lower():
-                    score += 1
-        
-        if score > best_score:
-            best_score = score
-            best_match = key
+    # Try partial matching: one point per key/name containing each word
+    scores = Counter()
+    for word in food_words:
+        postings = _INVERTED.get(word)
+        scores.update(postings if postings is not None else _word_postings(word))
     
-    return best_match if best_score > 0 else None
+    if not scores:
+        return None
+    # Highest score wins; ties go to the earliest key, as before
+    return _KEYS[max(scores, key=lambda idx: (scores[idx], -idx))]
 
-def detect_food_items(image_path):
+def detect_food_items(image_bytes):
     """
     Detect food items in the image using OpenAI Vision API.
     
     Returns list of detected items with structure:
     [{"key": "chicken_breast_pieces", "confidence": 0.72}, ...]
     """
+    openai_client = _get_openai_client()
     if not openai_client:
         print("OpenAI client not initialized. Returning empty list.")
         return []
     
     try:
-        # Encode image to base64
-        base64_image = encode_image_to_base64(image_path)
-        if not base64_image:
-            return []
-        
-        # Get image format
-        image = Image.open(image_path)
-        image_format = image.format.lower() if image.format else 'png'
-        mime_type = f'image/{image_format}'
+        # Reuse a previous reply for the same photo
+        image_hash = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+        response_text = _vision_cache_get(image_hash)
+        from_cache = response_text is not None
         
-        # Create prompt for OpenAI
-        # Get list of available food items for better matching
-        available_foods = list(CALORIE_DB.keys())[:50]  # Limit to first 50 for prompt size
-        food_list = ', '.join(available_foods)
-        
-        prompt = f"""Analyze this food photo and identify all food items visible on the plate.
-
-Return a JSON array with objects containing:
-- "food": the name/description of the food item (in English, be specific)
-- "estimated_grams": estimated portion size in grams
-
-Focus on identifying the main food items. Be specific about the type of food (e.g., "chicken breast" not just "chicken", "cooked rice" not just "rice").
-
-Example format:
-[
-  {{"food": "chicken breast", "estimated_grams": 150}},
-  {{"food": "cooked rice", "estimated_grams": 200}},
-  {{"food": "steamed broccoli", "estimated_grams": 100}}
-]
-
-Return ONLY valid JSON, no additional text."""
-
-        # Call OpenAI Vision API
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",  # or "gpt-4-vision-preview"
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime_type};base64,{base64_image}"
+        if not from_cache:
+            # Encode image to base64
+            mime_type, base64_image = encode_image_to_base64(image_bytes)
+            if not base64_image:
+                return []
+            # Build the data URL as bytes and decode once (base64 is plain ASCII)
+            image_url = b"data:" + mime_type.encode('ascii') + b";base64," + base64_image
+            
+            # Call OpenAI Vision API
+            response = openai_client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": _PROMPT
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": image_url.decode('ascii'),
+                                    "detail": "low"
+                                }
                             }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=500,
-            temperature=0.3
-        )
-        
-        # Parse response
-        response_text = response.choices[0].message.content.strip()
-        
-        # Try to extract JSON from response (in case there's extra text)
-        import re
-        json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
-        if json_match:
-            response_text = json_match.group(0)
-        
-        detected_foods = json.loads(response_text)
+                        ]
+                    }
+                ],
+                max_tokens=500,
+                temperature=0.3
+            )
+            
+            # Parse response
+            response_text = response.choices[0].message.content.strip()
+            
+            # Try to extract JSON from response (in case there's extra text)
+            json_match = _JSON_ARRAY_RE.search(response_text)
+            if json_match:
+                response_text = json_match.group(0)
+            
+        detected_foods = orjson.loads(response_text)
+        if not isinstance(detected_foods, list):
+            print(f"Unexpected OpenAI response (expected a JSON array): {response_text}")
+            return []
         
         # Match detected foods to CALORIE_DB keys
         result = []
         for item in detected_foods:
+            if not isinstance(item, dict):
+                continue
             food_name = item.get('food', '')
             if not food_name:
                 continue
             
             # Try to match to database
-            matched_key = match_food_to_db(food_name, CALORIE_DB)
+            matched_key = match_food_to_db(food_name)
             if matched_key:
                 # Use confidence based on how well it matched
                 confidence = 0.8 if matched_key else 0.5
@@ -200,9 +545,13 @@ Return ONLY valid JSON, no additional text."""
                     "estimated_grams": item.get('estimated_grams', 100)
                 })
         
+        # Only cache replies that produced matches, so a retry can still get a fresh answer
+        if result and not from_cache:
+            _vision_cache_put(image_hash, response_text)
+        
         return result
         
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"Error parsing OpenAI response as JSON: {e}")
         print(f"Response was: {response_text if 'response_text' in locals() else 'N/A'}")
         return []
@@ -214,7 +563,7 @@ Return ONLY valid JSON, no additional text."""
 def index():
     """Render main page with calorie database passed to template."""
     # Pass CALORIE_DB to template as JSON
-    return render_template('index.html', calorie_db=json.dumps(CALORIE_DB))
+    return render_template('index.html', calorie_db=CALORIE_DB_JSON)
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze_image():
@@ -230,29 +579,14 @@ def analyze_image():
         return jsonify({'error': 'Invalid file type'}), 400
     
     try:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Detect food items in image
-        detected_items = detect_food_items(filepath)
-        
-        # Clean up uploaded file
-        os.remove(filepath)
+        # Detect food items in image (processed in memory, nothing is written to disk)
+        detected_items = detect_food_items(file.read())
         
         return jsonify({
             'detected_items': detected_items
         })
     
     except Exception as e:
-        # Clean up file if it exists
-        try:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
-            if os.path.exists(filepath):
-                os.remove(filepath)
-        except:
-            pass
-        
         return jsonify({'error': f'Processing error: {str(e)}'}), 500
 
 if __name__ == '__main__':